@@ -63,9 +63,17 @@ do
 done
 
 # setup ogstun and routing
-modprobe ip_tables nf_conntrack nf_nat iptable_nat
+modprobe -a nf_tables nf_conntrack nf_nat ip_tables iptable_nat
 
-python3 setup_tun.py --ip_range ${UE_IP_RANGE}
+# Additional TUNs/UE pools (one per DNN/slice), e.g. UE_EXTRA_TUNS="ogstun2=10.46.0.0/16 ogstun3=10.47.0.0/16"
+EXTRA_TUN_ARGS=()
+for TUN in ${UE_EXTRA_TUNS:-}
+do
+    EXTRA_TUN_ARGS+=(--tun "${TUN}")
+done
+
+# Optional user-plane tuning, e.g. UE_TUN_TUNING="--mtu 1400 --txqueuelen 10000 --rps_cpus ff --offload"
+python3 setup_tun.py --ip_range ${UE_IP_RANGE} "${EXTRA_TUN_ARGS[@]}" ${UE_TUN_TUNING:-}
 if [ $? -ne 0 ]
 then
     echo "Failed to setup ogstun and routing"
@@ -93,6 +101,12 @@ then
     exit 1
 fi
 
+# Optional resident subscriber provisioning API (add/update/delete/list UEs at runtime)
+if [ -n "${SUBSCRIBER_SERVICE_PORT:-}" ]; then
+    python3 subscriber_service.py --mongodb "${MONGODB_IP}" --apn "${UE_APN}" --session_mode "${UE_SESSION_MODE}" \
+        --host "${SUBSCRIBER_SERVICE_HOST:-127.0.0.1}" --port "${SUBSCRIBER_SERVICE_PORT}" &
+fi
+
 # Run 5gc with selected configuration
 if [ "${DEBUG}" = "true" ]; then
     exec stdbuf -o L gdb -batch -ex=run -ex=bt --args 5gc -c "${OPEN5GS_RENDERED_CFG}"
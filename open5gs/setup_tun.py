@@ -1,13 +1,23 @@
 #!/usr/bin/env python3
 import click
+import glob
 import ipaddress
 import logging
-import re
 import shutil
+import socket
 import subprocess
 from pyroute2 import IPRoute
+from pyroute2.ethtool import Ethtool
+from pyroute2.ethtool.ioctl import EthtoolError
 from pyroute2.netlink import NetlinkError
 
+NFT_TABLE = "open5gs"
+# Prefix of the iptables chains holding our rules, e.g. OPEN5GS_FORWARD
+IPT_CHAIN_PREFIX = "OPEN5GS_"
+
+# ethtool feature names for GRO/GSO (see `ethtool -k <if>`)
+OFFLOAD_FEATURES = ("rx-gro", "tx-generic-segmentation")
+
 
 def handle_ip_string(ctx, param, value):
     try:
@@ -16,6 +26,27 @@ def handle_ip_string(ctx, param, value):
         raise click.BadParameter(f"{value} is not a valid IP range.")
 
 
+def handle_cpu_mask(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        int(value.replace(",", ""), 16)
+    except ValueError:
+        raise click.BadParameter(f"{value} is not a valid hex CPU mask.")
+    return value
+
+
+def handle_tun_strings(ctx, param, value):
+    # Each --tun is "<if_name>=<ip_range>", e.g. ogstun2=10.46.0.0/16
+    tuns = []
+    for item in value:
+        if_name, sep, ip_range = item.partition("=")
+        if not sep or not if_name:
+            raise click.BadParameter(f"{item} is not in the form <if_name>=<ip_range>.")
+        tuns.append((if_name, handle_ip_string(ctx, param, ip_range)))
+    return tuns
+
+
 def pick_iptables_binary():
     # Prefer nft backend if present (often avoids legacy xtables module dependencies)
     # xtables-nft tools manage the nf_tables backend using iptables syntax
@@ -25,9 +56,9 @@ def pick_iptables_binary():
     raise RuntimeError("No iptables binary found in container.")
 
 
-def run(cmd):
+def run(cmd, stdin=None):
     logging.info("RUN: %s", " ".join(cmd))
-    return subprocess.run(cmd, check=True, capture_output=True, text=True)
+    return subprocess.run(cmd, check=True, capture_output=True, text=True, input=stdin)
 
 
 def ensure_rule(iptables, table, chain, rule_args):
@@ -41,51 +72,97 @@ def ensure_rule(iptables, table, chain, rule_args):
         run(add)
 
 
-def default_egress_if():
-    out = subprocess.check_output(
-        ["ip", "-4", "route", "show", "default"], text=True
-    ).strip()
-    m = re.search(r"\bdev\s+(\S+)", out)
-    return m.group(1) if m else None
+def default_egress_if(ipr):
+    for route in ipr.get_default_routes(family=socket.AF_INET):
+        oif = route.get_attr("RTA_OIF")
+        if oif is None:
+            continue
+        links = ipr.get_links(oif)
+        if links:
+            return links[0].get_attr("IFLA_IFNAME")
+    return None
 
 
 def enable_ip_forward():
+    with open("/proc/sys/net/ipv4/ip_forward", "w") as f:
+        f.write("1\n")
+
+
+def write_queue_masks(if_name, kind, attr, mask):
+    # RPS/XPS masks are only exposed through sysfs, one file per queue
+    paths = sorted(glob.glob(f"/sys/class/net/{if_name}/queues/{kind}-*/{attr}"))
+    for path in paths:
+        with open(path, "w") as f:
+            f.write(f"{mask}\n")
+    return len(paths)
+
+
+def enable_offloads(if_name):
+    # Returns {feature: state} where state is "on", "off" or "unsupported"
+    eth = Ethtool()
     try:
-        run(["sysctl", "-w", "net.ipv4.ip_forward=1"])
-    except Exception:
-        # Fallback if sysctl is unavailable
-        with open("/proc/sys/net/ipv4/ip_forward", "w") as f:
-            f.write("1\n")
+        features = eth.get_features(if_name)
+        states = {}
+        for name in OFFLOAD_FEATURES:
+            feature = features.features.get(name)
+            if feature is None or not feature.available:
+                states[name] = "unsupported"
+                continue
+            feature.enable = True
+        eth.set_features(if_name, features)
 
+        features = eth.get_features(if_name)
+        for name in OFFLOAD_FEATURES:
+            if name not in states:
+                states[name] = "on" if features.features[name].enable else "off"
+        return states
+    finally:
+        eth.close()
 
-@click.command()
-@click.option("--if_name", default="ogstun", help="TUN interface name.")
-@click.option(
-    "--ip_range",
-    default="10.45.0.0/16",
-    callback=handle_ip_string,
-    help="UE IPv4 pool routed via the TUN (should match UPF/SMF config).",
-)
-def main(if_name, ip_range):
-    logging.basicConfig(
-        level=logging.INFO, format="[setup_tun] %(levelname)s  -  %(message)s"
-    )
 
-    iptables = pick_iptables_binary()
-    egress = default_egress_if()
-    if not egress:
-        raise RuntimeError(
-            "Cannot determine default egress interface inside container."
-        )
+def tune_tun(ipr, idx, if_name, mtu, txqueuelen, rps_cpus, xps_cpus, offload):
+    if mtu is not None or txqueuelen is not None:
+        attrs = {}
+        if mtu is not None:
+            attrs["mtu"] = mtu
+        if txqueuelen is not None:
+            attrs["txqlen"] = txqueuelen
+        ipr.link("set", index=idx, **attrs)
+
+    report = {}
+    if rps_cpus is not None:
+        report["rps_queues"] = write_queue_masks(if_name, "rx", "rps_cpus", rps_cpus)
+    if xps_cpus is not None:
+        report["xps_queues"] = write_queue_masks(if_name, "tx", "xps_cpus", xps_cpus)
+    if offload:
+        try:
+            report.update(enable_offloads(if_name))
+        except (EthtoolError, OSError) as e:
+            logging.warning("Cannot set GRO/GSO on %s: %s", if_name, e)
 
-    # Use the first usable address for ogstun, as in Open5GS docs (e.g., 10.45.0.1/16)
-    ogstun_ip = str(next(ip_range.hosts()))
+    link = ipr.get_links(idx)[0]
+    report["mtu"] = link.get_attr("IFLA_MTU")
+    report["txqueuelen"] = link.get_attr("IFLA_TXQLEN")
+    report["tx_queues"] = link.get_attr("IFLA_NUM_TX_QUEUES")
+    report["rx_queues"] = link.get_attr("IFLA_NUM_RX_QUEUES")
+    return report
+
+
+def setup_tun(ipr, if_name, ip_range, multi_queue=False, **tuning):
+    # Use the first usable address for the TUN, as in Open5GS docs (e.g., 10.45.0.1/16)
+    tun_ip = str(next(ip_range.hosts()))
     prefix = ip_range.prefixlen
 
-    ipr = IPRoute()
+    ifr = {
+        "no_pi": True,
+        "one_queue": False,
+        "vnet_hdr": False,
+        "tun_excl": False,
+        "multi_queue": multi_queue,
+    }
     try:
-        ipr.link("add", ifname=if_name, kind="tuntap", mode="tun")
-        logging.info("Created TUN: %s", if_name)
+        ipr.link("add", ifname=if_name, kind="tuntap", mode="tun", ifr=ifr)
+        logging.info("Created TUN: %s (multi_queue=%s)", if_name, multi_queue)
     except NetlinkError as e:
         logging.info("TUN exists or cannot be created: %s", e)
 
@@ -96,56 +173,235 @@ def main(if_name, ip_range):
 
     ipr.link("set", index=idx, state="down")
     try:
-        ipr.addr("add", index=idx, address=ogstun_ip, mask=prefix)
+        ipr.addr("add", index=idx, address=tun_ip, mask=prefix)
     except NetlinkError as e:
         logging.info("Address add skipped/failed (may already exist): %s", e)
+    report = tune_tun(ipr, idx, if_name, **tuning)
     ipr.link("set", index=idx, state="up")
 
-    enable_ip_forward()
+    return tun_ip, report
 
-    # NAT: MASQUERADE UE pool for any egress except ogstun, matching Open5GS guidance
-    ensure_rule(
-        iptables,
-        "nat",
-        "POSTROUTING",
-        ["-s", ip_range.with_prefixlen, "!", "-o", if_name, "-j", "MASQUERADE"],
-    )
 
-    # Forwarding rules (typical minimal stateful policy for NAT gateway)
-    ensure_rule(
-        iptables, "filter", "FORWARD", ["-i", if_name, "-o", egress, "-j", "ACCEPT"]
-    )
-    ensure_rule(
-        iptables,
-        "filter",
-        "FORWARD",
-        [
-            "-i",
-            egress,
-            "-o",
-            if_name,
-            "-m",
-            "conntrack",
-            "--ctstate",
-            "RELATED,ESTABLISHED",
-            "-j",
-            "ACCEPT",
-        ],
+def nft_ruleset(tuns):
+    # The whole table is declared, flushed and refilled in a single `nft -f`
+    # transaction, so re-running is idempotent and rules are never half-applied.
+    # Only NAT lives here: an accept verdict in this table cannot override a drop
+    # in another one (e.g. the iptables-nft 'ip filter' chains), so the
+    # forward/input accept rules are added with iptables (see filter_rules).
+    nat = []
+    for if_name, ip_range in tuns:
+        # NAT: MASQUERADE UE pool for any egress except its TUN, matching Open5GS guidance
+        nat.append(
+            f'ip saddr {ip_range.with_prefixlen} oifname != "{if_name}" masquerade'
+        )
+
+    body = "".join(f"\t\t{r}\n" for r in nat)
+    return (
+        f"table ip {NFT_TABLE}\n"
+        f"flush table ip {NFT_TABLE}\n"
+        f"table ip {NFT_TABLE} {{\n"
+        f"\tchain postrouting {{\n"
+        f"\t\ttype nat hook postrouting priority srcnat; policy accept;\n"
+        f"{body}\t}}\n"
+        "}\n"
     )
 
-    # Optional: allow local access to the container via ogstun (ping 10.45.0.1 etc.)
-    ensure_rule(iptables, "filter", "INPUT", ["-i", if_name, "-j", "ACCEPT"])
-
-    logging.info(
-        "TUN+NAT ready: %s=%s/%d, UE pool=%s, egress=%s, iptables=%s",
-        if_name,
-        ogstun_ip,
-        prefix,
-        ip_range.with_prefixlen,
-        egress,
-        iptables,
+
+def nat_rules(tuns):
+    # {builtin chain: [rule args]} of the 'nat' table
+    return {
+        "POSTROUTING": [
+            ["-s", ip_range.with_prefixlen, "!", "-o", if_name, "-j", "MASQUERADE"]
+            for if_name, ip_range in tuns
+        ]
+    }
+
+
+def filter_rules(tuns, egress):
+    # {builtin chain: [rule args]} of the 'filter' table
+    forward, inp = [], []
+    for if_name, ip_range in tuns:
+        # Forwarding rules (typical minimal stateful policy for NAT gateway)
+        forward.append(["-i", if_name, "-o", egress, "-j", "ACCEPT"])
+        forward.append(
+            [
+                "-i",
+                egress,
+                "-o",
+                if_name,
+                "-m",
+                "conntrack",
+                "--ctstate",
+                "RELATED,ESTABLISHED",
+                "-j",
+                "ACCEPT",
+            ]
+        )
+        # Optional: allow local access to the container via the TUN (ping 10.45.0.1 etc.)
+        inp.append(["-i", if_name, "-j", "ACCEPT"])
+    return {"FORWARD": forward, "INPUT": inp}
+
+
+def iptables_restore_input(tables, saved):
+    # Rules go into OPEN5GS_<CHAIN> chains, flushed and refilled by the same
+    # `iptables-restore --noflush` transaction; the jump from the builtin chain
+    # is only added if `iptables-save` does not already show it.
+    lines = []
+    for table, chains in tables.items():
+        lines.append(f"*{table}")
+        for builtin in chains:
+            lines.append(f":{IPT_CHAIN_PREFIX}{builtin} - [0:0]")
+        for builtin, rules in chains.items():
+            chain = f"{IPT_CHAIN_PREFIX}{builtin}"
+            lines.append(f"-F {chain}")
+            lines.extend(f"-A {chain} {' '.join(rule)}" for rule in rules)
+            jump = f"-A {builtin} -j {chain}"
+            if jump not in saved.get(table, ()):
+                lines.append(jump)
+        lines.append("COMMIT")
+    return "\n".join(lines) + "\n"
+
+
+def parse_iptables_save(output):
+    # {table: set of rule lines}
+    saved, table = {}, None
+    for line in output.splitlines():
+        if line.startswith("*"):
+            table = line[1:]
+            saved[table] = set()
+        elif table and line.startswith("-A "):
+            saved[table].add(line)
+    return saved
+
+
+def apply_iptables_rules(iptables, tables):
+    # One iptables-save + one iptables-restore for all TUNs; the per-rule
+    # -C/-A path is only the fallback when the restore tools fail/are missing.
+    save, restore = f"{iptables}-save", f"{iptables}-restore"
+    if shutil.which(save) and shutil.which(restore):
+        try:
+            saved = parse_iptables_save(run([save]).stdout)
+            run([restore, "--noflush"], stdin=iptables_restore_input(tables, saved))
+            return
+        except subprocess.CalledProcessError as e:
+            logging.warning(
+                "%s failed, adding rules one by one: %s", restore, e.stderr.strip()
+            )
+
+    for table, chains in tables.items():
+        for chain, rules in chains.items():
+            for rule_args in rules:
+                ensure_rule(iptables, table, chain, rule_args)
+
+
+@click.command()
+@click.option("--if_name", default="ogstun", help="TUN interface name.")
+@click.option(
+    "--ip_range",
+    default="10.45.0.0/16",
+    callback=handle_ip_string,
+    help="UE IPv4 pool routed via the TUN (should match UPF/SMF config).",
+)
+@click.option(
+    "--tun",
+    "tuns",
+    multiple=True,
+    callback=handle_tun_strings,
+    help="Additional TUN and UE pool as <if_name>=<ip_range> (one per DNN/slice). Repeatable.",
+)
+@click.option(
+    "--multi_queue",
+    is_flag=True,
+    help="Create the TUN with IFF_MULTI_QUEUE (the UPF must open it with the same flag).",
+)
+@click.option("--mtu", type=click.IntRange(68, 65535), help="TUN MTU.")
+@click.option("--txqueuelen", type=click.IntRange(0), help="TUN transmit queue length.")
+@click.option(
+    "--rps_cpus",
+    callback=handle_cpu_mask,
+    help="Hex CPU mask for Receive Packet Steering on every RX queue (e.g. ff).",
+)
+@click.option(
+    "--xps_cpus",
+    callback=handle_cpu_mask,
+    help="Hex CPU mask for Transmit Packet Steering on every TX queue (e.g. ff).",
+)
+@click.option(
+    "--offload", is_flag=True, help="Enable GRO/GSO on the TUN where supported."
+)
+def main(
+    if_name, ip_range, tuns, multi_queue, mtu, txqueuelen, rps_cpus, xps_cpus, offload
+):
+    logging.basicConfig(
+        level=logging.INFO, format="[setup_tun] %(levelname)s  -  %(message)s"
     )
 
+    tuns = [(if_name, ip_range)] + [t for t in tuns if t[0] != if_name]
+
+    with IPRoute() as ipr:
+        egress = default_egress_if(ipr)
+        if not egress:
+            raise RuntimeError(
+                "Cannot determine default egress interface inside container."
+            )
+
+        results = [
+            setup_tun(
+                ipr,
+                name,
+                pool,
+                multi_queue=multi_queue,
+                mtu=mtu,
+                txqueuelen=txqueuelen,
+                rps_cpus=rps_cpus,
+                xps_cpus=xps_cpus,
+                offload=offload,
+            )
+            for name, pool in tuns
+        ]
+
+    enable_ip_forward()
+
+    backend = None
+    if shutil.which("nft"):
+        try:
+            run(["nft", "-f", "-"], stdin=nft_ruleset(tuns))
+            backend = "nft"
+        except subprocess.CalledProcessError as e:
+            # e.g. nf_tables not available in the kernel even if the binary is
+            logging.warning(
+                "nft ruleset failed, falling back to iptables: %s", e.stderr.strip()
+            )
+
+    if backend is None:
+        backend = pick_iptables_binary()
+        apply_iptables_rules(
+            backend, {"nat": nat_rules(tuns), "filter": filter_rules(tuns, egress)}
+        )
+    else:
+        try:
+            apply_iptables_rules(
+                pick_iptables_binary(), {"filter": filter_rules(tuns, egress)}
+            )
+        except (RuntimeError, subprocess.CalledProcessError) as e:
+            logging.warning("Forward/input accept rules not added: %s", e)
+
+    for (name, pool), (tun_ip, report) in zip(tuns, results):
+        logging.info(
+            "TUN+NAT ready: %s=%s/%d, UE pool=%s, egress=%s, backend=%s",
+            name,
+            tun_ip,
+            pool.prefixlen,
+            pool.with_prefixlen,
+            egress,
+            backend,
+        )
+        logging.info(
+            "TUN tuning: %s %s",
+            name,
+            " ".join(f"{k}={v}" for k, v in report.items()),
+        )
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+import click
+import json
+import logging
+import pymongo
+import threading
+from bson import json_util
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from add_users import add_user, read_from_string
+
+# Fields accepted for each subscriber, as returned by read_from_string/read_from_db
+UE_FIELDS = ("imsi", "key", "op", "opc", "amf", "qci", "ip_alloc")
+# Fields that must be strings when given (op/opc may also be null, see add_user)
+STRING_FIELDS = ("key", "amf", "ip_alloc", "apn")
+NULLABLE_STRING_FIELDS = ("op", "opc")
+SESSION_MODES = (1, 2, 3)  # 1: IPV4, 2: IPV6, 3: IPV4V6
+
+
+class SubscriberStore:
+    """Subscriber collection behind a single pooled MongoClient, with a cache of the existing IMSIs for listing."""
+
+    def __init__(self, mongodb, mongodb_port, apn, session_mode, pool_size):
+        # Same database/collection as misc.db.python.Open5GS, which instead opens a client per call
+        self.client = pymongo.MongoClient(
+            mongodb, mongodb_port, maxPoolSize=pool_size, connect=True
+        )
+        self.col = self.client["open5gs"]["subscribers"]
+        self.apn = apn
+        self.session_mode = session_mode
+        self.lock = threading.Lock()
+        self.imsis = set()
+        self.refresh()
+
+    def refresh(self):
+        imsis = {doc["imsi"] for doc in self.col.find({}, {"imsi": 1, "_id": 0})}
+        with self.lock:
+            self.imsis = imsis
+        logging.info("Loaded %d subscribers", len(imsis))
+        return len(imsis)
+
+    def list(self):
+        with self.lock:
+            return sorted(self.imsis)
+
+    def get(self, imsi):
+        # Always asks mongodb: the subscriber may have been added/removed elsewhere
+        # (WebUI, add_users.py), only the list relies on the cache alone
+        sub_data = self.col.find_one({"imsi": imsi}, {"_id": 0})
+        with self.lock:
+            if sub_data is None:
+                self.imsis.discard(imsi)
+            else:
+                self.imsis.add(imsi)
+        return sub_data
+
+    def upsert(self, ues):
+        """Add or update the given subscribers with one unordered bulk write."""
+        ops = []
+        for ue in ues:
+            apn = ue.pop("apn", self.apn)
+            session_mode = ue.pop("session_mode", self.session_mode)
+            try:
+                sub_data = add_user(**ue, apn=apn, session_mode=session_mode)
+            except TypeError as e:
+                raise ValueError(f"invalid subscriber {ue.get('imsi')}: {e}")
+            ops.append(pymongo.ReplaceOne({"imsi": ue["imsi"]}, sub_data, upsert=True))
+        if not ops:
+            return {"added": 0, "updated": 0}
+
+        result = self.col.bulk_write(ops, ordered=False)
+        with self.lock:
+            self.imsis.update(ue["imsi"] for ue in ues)
+        return {"added": result.upserted_count, "updated": result.matched_count}
+
+    def delete(self, imsi):
+        deleted = self.col.delete_one({"imsi": imsi}).deleted_count
+        with self.lock:
+            self.imsis.discard(imsi)
+        return deleted > 0
+
+
+def check_ue(ue):
+    """Raise ValueError unless the subscriber fields have the types add_user expects."""
+    imsi = ue.get("imsi")
+    if not isinstance(imsi, str) or not (imsi.isascii() and imsi.isdigit()):
+        raise ValueError("imsi must be a string of digits")
+    if len(imsi) > 15:
+        raise ValueError(f"imsi {imsi} is longer than 15 digits")
+    for name in STRING_FIELDS:
+        if name in ue and not isinstance(ue[name], str):
+            raise ValueError(f"{name} must be a string (imsi {imsi})")
+    for name in NULLABLE_STRING_FIELDS:
+        if ue.get(name) is not None and not isinstance(ue[name], str):
+            raise ValueError(f"{name} must be a string or null (imsi {imsi})")
+    qci = ue.get("qci", "9")
+    if isinstance(qci, bool) or not (
+        isinstance(qci, int) or (isinstance(qci, str) and qci.isdigit())
+    ):
+        raise ValueError(f"qci must be an integer (imsi {imsi})")
+    session_mode = ue.get("session_mode", SESSION_MODES[0])
+    if isinstance(session_mode, bool) or session_mode not in SESSION_MODES:
+        raise ValueError(f"session_mode must be 1, 2 or 3 (imsi {imsi})")
+
+
+def parse_ues(body):
+    """
+    Subscribers from a request body: a subscriber data string (same format as SUBSCRIBER_DB),
+    a JSON object with UE_FIELDS (plus optional "apn"/"session_mode") or a list of them.
+    """
+    if isinstance(body, dict) and "subscriber_data" in body:
+        if not isinstance(body["subscriber_data"], str):
+            raise ValueError("subscriber_data must be a string")
+        ues = read_from_string(body["subscriber_data"])
+        if ues is None:
+            raise ValueError("invalid subscriber_data string")
+        for ue in ues:
+            check_ue(ue)
+        return ues
+
+    items = body if isinstance(body, list) else [body]
+    ues = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError("each subscriber must be an object")
+        unknown = set(item) - set(UE_FIELDS) - {"apn", "session_mode"}
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+        check_ue(item)
+        ues.append(dict(item))
+    return ues
+
+
+class SubscriberHandler(BaseHTTPRequestHandler):
+    # Set on the server class by main()
+    store: SubscriberStore = None
+
+    def log_message(self, format, *args):
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+    def reply(self, status, payload):
+        # json_util: documents created by the WebUI hold ObjectIds in sub-documents
+        data = json_util.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"null")
+
+    def route(self):
+        # Returns (imsi, query) for /subscribers[/<imsi>], None for any other path
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        if not parts or parts[0] != "subscribers" or len(parts) > 2:
+            return None
+        return (parts[1] if len(parts) == 2 else None), parse_qs(url.query)
+
+    def handle_request(self, method):
+        route = self.route()
+        if route is None:
+            return self.reply(404, {"ok": False, "err": "not found"})
+        imsi, query = route
+
+        try:
+            if method == "GET" and imsi is None:
+                if query.get("refresh", ["0"])[0] in ("1", "true"):
+                    self.store.refresh()
+                return self.reply(200, {"ok": True, "imsis": self.store.list()})
+
+            if method == "GET":
+                sub_data = self.store.get(imsi)
+                if sub_data is None:
+                    return self.reply(404, {"ok": False, "err": "unknown imsi"})
+                return self.reply(200, {"ok": True, "subscriber": sub_data})
+
+            if method == "POST" and imsi is None:
+                ues = parse_ues(self.read_body())
+                return self.reply(200, {"ok": True, **self.store.upsert(ues)})
+
+            if method == "PUT" and imsi is not None:
+                body = self.read_body() or {}
+                if not isinstance(body, dict):
+                    raise ValueError("body must be a JSON object")
+                ues = parse_ues({**body, "imsi": imsi})
+                return self.reply(200, {"ok": True, **self.store.upsert(ues)})
+
+            if method == "DELETE" and imsi is not None:
+                if not self.store.delete(imsi):
+                    return self.reply(404, {"ok": False, "err": "unknown imsi"})
+                return self.reply(200, {"ok": True, "deleted": imsi})
+
+            return self.reply(405, {"ok": False, "err": "method not allowed"})
+        except ValueError as e:
+            # Also covers json.JSONDecodeError
+            return self.reply(400, {"ok": False, "err": str(e)})
+        except pymongo.errors.PyMongoError as e:
+            logging.exception("MongoDB error on %s %s", method, self.path)
+            return self.reply(503, {"ok": False, "err": str(e)})
+        except Exception as e:
+            logging.exception("Unexpected error on %s %s", method, self.path)
+            return self.reply(500, {"ok": False, "err": str(e)})
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def do_PUT(self):
+        self.handle_request("PUT")
+
+    def do_DELETE(self):
+        self.handle_request("DELETE")
+
+
+@click.command()
+@click.option(
+    "--mongodb",
+    default="127.0.0.1",
+    help="IP address or hostname of the mongodb instance.",
+)
+@click.option(
+    "--mongodb_port", default=27017, help="Port to connect to the mongodb instance."
+)
+@click.option("--host", default="127.0.0.1", help="Address the HTTP API listens on.")
+@click.option("--port", default=9090, help="Port the HTTP API listens on.")
+@click.option(
+    "--apn",
+    default="srsapn",
+    help="Default APN/DNN used for data sessions of the new subscribers.",
+)
+@click.option(
+    "--session_mode",
+    default=3,
+    type=int,
+    help="Default session mode for the data sessions of the new subscribers. 1: IPV4, 2: IPV6, 3: IPV4V6",
+)
+@click.option(
+    "--pool_size", default=10, help="Max pooled connections to the mongodb instance."
+)
+def main(mongodb, mongodb_port, host, port, apn, session_mode, pool_size):
+    logging.basicConfig(
+        level=logging.INFO, format="[subscriber_service] %(levelname)s  -  %(message)s"
+    )
+
+    SubscriberHandler.store = SubscriberStore(
+        mongodb, mongodb_port, apn, session_mode, pool_size
+    )
+    server = ThreadingHTTPServer((host, port), SubscriberHandler)
+    server.daemon_threads = True
+    logging.info("Subscriber API listening on http://%s:%d/subscribers", host, port)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -25,7 +25,8 @@ if [ -n "$RETINA_PORTS" ]; then
   # In this mode, we expect to receive data over UDP, telling websocket ip/port of the server.
   export WS_URL=$(socat -u UDP-RECVFROM:"${RETINA_PORTS}",reuseaddr STDOUT)
 fi
-telegraf --config /etc/srs/telegraf.conf $TELEGRAF_CLI_EXTRA_ARGS &
+export WS_ADAPTER_FORMAT="${WS_ADAPTER_FORMAT:-json}"
+telegraf --config /etc/srs/telegraf.conf --config "/etc/srs/ws_${WS_ADAPTER_FORMAT}.conf" $TELEGRAF_CLI_EXTRA_ARGS &
 child=$!
 
 health_code=0
@@ -1,28 +1,808 @@
 #!/usr/bin/env python3
 
+import asyncio
 from contextlib import suppress
+from datetime import datetime, timedelta
+import glob
+import gzip
+import math
 import os
 import json
-from time import sleep
-import websocket
+import queue
+import random
+import re
+import sys
+import threading
+import traceback
+from time import monotonic, sleep, time_ns
+import urllib.error
+import urllib.parse
+import urllib.request
+import websockets
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def _on_open(ws: websocket.WebSocketApp):
-    ws.send(json.dumps({"cmd": "metrics_subscribe"}))
+# Replies to our own commands (e.g. {"cmd": "metrics_subscribe"}) carry "cmd" as
+# first key; metrics documents never do, so they can be filtered without decoding.
+_CMD_PREFIX = re.compile(r'\s*\{\s*"cmd"\s*:')
 
+# "json": forward srsRAN JSON as is (parsed by Telegraf's xpath_json, see ws_json.conf)
+# "influx": convert to Influx line protocol here (see ws_influx.conf)
+OUTPUT_FORMAT = os.environ.get("WS_ADAPTER_FORMAT", "json")
+QUEUE_SIZE = int(os.environ.get("WS_ADAPTER_QUEUE_SIZE", "10000"))
+BATCH_SIZE = int(os.environ.get("WS_ADAPTER_BATCH_SIZE", "256"))
+FLUSH_INTERVAL = float(os.environ.get("WS_ADAPTER_FLUSH_INTERVAL", "0.05"))
+STATS_INTERVAL = float(os.environ.get("WS_ADAPTER_STATS_INTERVAL", "10"))
+PING_INTERVAL = float(os.environ.get("WS_ADAPTER_PING_INTERVAL", "5"))
+PING_TIMEOUT = float(os.environ.get("WS_ADAPTER_PING_TIMEOUT", "5"))
+BACKOFF_MIN = float(os.environ.get("WS_ADAPTER_BACKOFF_MIN", "0.5"))
+BACKOFF_MAX = float(os.environ.get("WS_ADAPTER_BACKOFF_MAX", "30"))
+# Seconds of per-UE metrics summarised into one min/mean/max/last sample (0: off)
+AGGREGATE_INTERVAL = float(os.environ.get("WS_ADAPTER_AGGREGATE_INTERVAL", "0"))
+# Directory of the on-disk spool used while InfluxDB is unavailable (empty: off)
+SPOOL_DIR = os.environ.get("WS_SPOOL_DIR", "")
+SPOOL_MAX_BYTES = int(os.environ.get("WS_SPOOL_MAX_BYTES", str(1 << 30)))
+SPOOL_SEGMENT_BYTES = int(os.environ.get("WS_SPOOL_SEGMENT_BYTES", str(8 << 20)))
+SPOOL_CHECK_INTERVAL = float(os.environ.get("WS_SPOOL_CHECK_INTERVAL", "2"))
+SPOOL_CHECK_TIMEOUT = float(os.environ.get("WS_SPOOL_CHECK_TIMEOUT", "1"))
 
-def _on_message(_ws: websocket.WebSocketApp, message: str):
-    with suppress(json.JSONDecodeError):
-        metric = json.loads(message)
-        if "cmd" not in metric:
-            print(json.dumps(metric))
 
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.forwarded = 0
+        self.dropped = 0
+        self.filtered = 0
+        self.spooled = 0
+        self.aggregated = 0
 
-if __name__ == "__main__":
-    ws_app = websocket.WebSocketApp(
-        "ws://" + os.environ["WS_URL"],
-        on_open=_on_open,
-        on_message=_on_message,
+    def add(self, forwarded=0, dropped=0, filtered=0, spooled=0, aggregated=0):
+        with self.lock:
+            self.forwarded += forwarded
+            self.dropped += dropped
+            self.filtered += filtered
+            self.spooled += spooled
+            self.aggregated += aggregated
+
+    def take(self):
+        with self.lock:
+            counts = (
+                self.forwarded,
+                self.dropped,
+                self.filtered,
+                self.spooled,
+                self.aggregated,
+            )
+            self.forwarded = self.dropped = self.filtered = 0
+            self.spooled = self.aggregated = 0
+        return counts
+
+
+_lines: "queue.Queue[bytes]" = queue.Queue(maxsize=QUEUE_SIZE)
+_stats = _Stats()
+
+
+# Top-level keys that are not routed to the generic "fallback" measurements
+_NOT_FALLBACK = {
+    "timestamp",
+    "source",
+    "cells",
+    "ru",
+    "cu-cp",
+    "ngaps",
+    "rrcs",
+    "internal_",
+}
+
+_EPOCH = datetime(1970, 1, 1)
+_ESCAPE_MEASUREMENT = str.maketrans({",": r"\,", " ": r"\ "})
+_ESCAPE_KEY = str.maketrans({",": r"\,", "=": r"\=", " ": r"\ "})
+_ESCAPE_STRING = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+
+def _decode(message: str):
+    if orjson is not None:
+        return orjson.loads(message)
+    return json.loads(message)
+
+
+def _children(node):
+    """Equivalent of the XPath step `node/*` on a decoded JSON value."""
+    if isinstance(node, list):
+        return node
+    if isinstance(node, dict):
+        return node.values()
+    return ()
+
+
+def _first(node, *path):
+    """Value at `path` below `node`, descending into the first item of lists."""
+    for key in path:
+        while isinstance(node, list):
+            node = node[0] if node else None
+        if not isinstance(node, dict):
+            return None
+        node = node.get(key)
+    return node
+
+
+def _leaves(node, expand, skip=()):
+    """Fields from the leaves below `node`, like `descendant::*[not(*)]`.
+
+    With `expand` the field name is the path from `node` joined by "_"
+    (Telegraf's `field_name_expansion`), otherwise only the leaf name.
+    """
+    fields = {}
+
+    def walk(value, name):
+        if isinstance(value, dict):
+            for key, child in value.items():
+                if key not in skip:
+                    walk(child, f"{name}_{key}" if expand and name else key)
+        elif isinstance(value, list):
+            for child in value:
+                walk(child, name)
+        elif name and value is not None:
+            fields[name] = value
+
+    walk(node, "")
+    return fields
+
+
+def _tag_value(value):
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).translate(_ESCAPE_KEY)
+
+
+def _field_value(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        # No "i" suffix: xpath_native_types stores every JSON number as a float
+        return repr(float(value)) if math.isfinite(value) else None
+    return '"' + str(value).translate(_ESCAPE_STRING) + '"'
+
+
+def _timestamp_ns(doc) -> str:
+    ts = doc.get("timestamp")
+    if isinstance(ts, (int, float)) and not isinstance(ts, bool):
+        return str(int(ts * 1e9))
+    if isinstance(ts, str):
+        with suppress(ValueError):
+            parsed = datetime.strptime(ts, "%Y-%m-%dT%H:%M:%S.%f")
+            return str((parsed - _EPOCH) // timedelta(microseconds=1) * 1000)
+    return ""
+
+
+def _line(measurement, tags, fields, ts):
+    field_set = ",".join(
+        f"{key.translate(_ESCAPE_KEY)}={value}"
+        for key, value in ((k, _field_value(v)) for k, v in fields.items())
+        if value is not None
     )
-    while ws_app.run_forever():  # Returns False when the connection is closed
-        sleep(1)
+    if not field_set:
+        return None
+    tag_set = "".join(
+        f",{key}={_tag_value(value)}"
+        for key, value in tags.items()
+        if value is not None and value != ""
+    )
+    line = f"{measurement.translate(_ESCAPE_MEASUREMENT)}{tag_set} {field_set}"
+    return f"{line} {ts}" if ts else line
+
+
+def _to_influx(doc, source) -> "list[str]":
+    """Flatten an srsRAN metrics document into Influx line protocol.
+
+    Measurements, tags and field names follow the `inputs.execd.xpath`
+    selectors of ws_json.conf; every line is tagged with its `source`.
+    """
+    ts = _timestamp_ns(doc)
+    src = {"source": source}
+    lines = []
+
+    for cell in _children(doc.get("cells")):
+        if not isinstance(cell, dict):
+            continue
+        for ue in _children(cell.get("ue_list")):
+            if isinstance(ue, dict):
+                fields = {
+                    k: v
+                    for k, v in ue.items()
+                    if k not in ("pci", "rnti") and not isinstance(v, (dict, list))
+                }
+                tags = {**src, "pci": ue.get("pci"), "rnti": ue.get("rnti")}
+                lines.append(_line("ue", tags, fields, ts))
+        if "cell_metrics" in cell:
+            lines.append(_line("cell", src, _leaves(cell["cell_metrics"], False), ts))
+        for event in _children(cell.get("event_list")):
+            lines.append(_line("event_list", src, _leaves(event, False), ts))
+
+    ofh = _first(doc, "ru", "ofh")
+    if isinstance(ofh, dict):
+        for ofh_cell in _children(ofh.get("cells")):
+            tags = {**src, "pci": _first(ofh_cell, "pci")}
+            lines.append(_line("ofh", tags, _leaves(ofh_cell, True, ("pci",)), ts))
+        for stats in _children(ofh.get("timing_stats")):
+            lines.append(_line("timing_stats", src, _leaves(stats, True), ts))
+
+    cu_cp = doc.get("cu-cp")
+    if isinstance(cu_cp, dict):
+        lines.append(_line("cu_cp", src, _leaves(cu_cp, False, ("ngaps", "rrcs")), ts))
+        for ngaps in _children(cu_cp.get("ngaps")):
+            for ngap in _children(ngaps):
+                tags = {
+                    **src,
+                    "amf_name": _first(ngap, "amf_name"),
+                    "snssai": _first(ngap, "pdu_session_management", "s-nssai"),
+                }
+                lines.append(
+                    _line("ngaps", tags, _leaves(ngap, True, ("amf_name",)), ts)
+                )
+        for rrcs in _children(cu_cp.get("rrcs")):
+            for rrc in _children(rrcs):
+                tags = {**src, "gnb_du_id": _first(rrc, "gnb_du_id")}
+                lines.append(
+                    _line("rrcs", tags, _leaves(rrc, True, ("gnb_du_id",)), ts)
+                )
+
+    for name, value in doc.items():
+        if name not in _NOT_FALLBACK:
+            lines.append(_line(name, src, _leaves(value, True), ts))
+
+    return [line for line in lines if line]
+
+
+def _encode_influx(doc, source: str) -> "bytes | None":
+    lines = _to_influx(doc, source)
+    if not lines:
+        return None
+    return ("\n".join(lines) + "\n").encode()
+
+
+def _encode_json(doc, source: str) -> bytes:
+    doc = {"source": source, **doc}
+    if orjson is not None:
+        return orjson.dumps(doc) + b"\n"
+    return json.dumps(doc).encode() + b"\n"
+
+
+_encode = _encode_influx if OUTPUT_FORMAT == "influx" else _encode_json
+
+
+class _Window:
+    __slots__ = ("stats", "last", "timestamp")
+
+    def __init__(self):
+        self.stats = {}  # numeric field -> [min, max, sum, count]
+        self.last = {}  # any field -> last value
+        self.timestamp = None
+
+
+class _UeAggregator:
+    """Per-(source, pci, rnti) windows of `ue_list` entries.
+
+    `add` moves the UE entries out of a report into the windows; `flush`
+    turns every window into one entry with the last value of each field plus
+    `<field>_min`, `<field>_mean` and `<field>_max` for numeric fields.
+    """
+
+    def __init__(self):
+        self.windows = {}
+
+    def add(self, doc, source: str) -> int:
+        """Move the UE entries of `doc` into the windows, return how many."""
+        added = 0
+        for cell in _children(doc.get("cells")):
+            if not isinstance(cell, dict) or "ue_list" not in cell:
+                continue
+            for ue in _children(cell.pop("ue_list")):
+                if isinstance(ue, dict):
+                    self._add_ue(source, ue, doc.get("timestamp"))
+                    added += 1
+        return added
+
+    def _add_ue(self, source: str, ue, timestamp):
+        key = (source, ue.get("pci"), ue.get("rnti"))
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = _Window()
+        window.timestamp = timestamp
+        for name, value in ue.items():
+            if name in ("pci", "rnti") or isinstance(value, (dict, list)):
+                continue
+            window.last[name] = value
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            stat = window.stats.get(name)
+            if stat is None:
+                window.stats[name] = [value, value, value, 1]
+            else:
+                if value < stat[0]:
+                    stat[0] = value
+                if value > stat[1]:
+                    stat[1] = value
+                stat[2] += value
+                stat[3] += 1
+
+    def flush(self) -> "list[tuple[dict, str]]":
+        """Return the synthetic reports and start new windows.
+
+        There is one report per (source, timestamp), so that every UE keeps
+        the timestamp of its own last report.
+        """
+        docs = {}
+        for (source, pci, rnti), window in self.windows.items():
+            entry = {"pci": pci, "rnti": rnti, **window.last}
+            for name, (low, high, total, count) in window.stats.items():
+                entry[f"{name}_min"] = low
+                entry[f"{name}_mean"] = total / count
+                entry[f"{name}_max"] = high
+            doc = docs.get((source, window.timestamp))
+            if doc is None:
+                doc = docs[(source, window.timestamp)] = {"cells": [{"ue_list": []}]}
+                if window.timestamp is not None:
+                    doc["timestamp"] = window.timestamp
+            doc["cells"][0]["ue_list"].append(entry)
+        self.windows = {}
+        return [(doc, source) for (source, _), doc in docs.items()]
+
+
+_aggregator = _UeAggregator() if AGGREGATE_INTERVAL > 0 else None
+
+
+def _to_influx_lines(message: str, source: str) -> "bytes | None":
+    if _CMD_PREFIX.match(message):
+        _stats.add(filtered=1)
+        return None
+    try:
+        doc = _decode(message)
+    except ValueError:
+        _stats.add(filtered=1)
+        return None
+    line = _encode_influx(doc, source) if isinstance(doc, dict) else None
+    if line is None:
+        _stats.add(filtered=1)
+    return line
+
+
+def _to_aggregated(message: str, source: str) -> "bytes | None":
+    """Like `_to_line`/`_to_influx_lines`, with UE entries kept for aggregation."""
+    if _CMD_PREFIX.match(message):
+        _stats.add(filtered=1)
+        return None
+    try:
+        doc = _decode(message)
+    except ValueError:
+        _stats.add(filtered=1)
+        return None
+    if not isinstance(doc, dict):
+        _stats.add(filtered=1)
+        return None
+    aggregated = _aggregator.add(doc, source)
+    _stats.add(aggregated=aggregated)
+    # Whatever is left (cell metrics, event_list, ...) is passed through as is
+    line = _encode(doc, source)
+    if line is None and not aggregated:
+        # A report made only of UE entries is not filtered, it is in the windows
+        _stats.add(filtered=1)
+    return line
+
+
+def _to_line(message: str, source: str) -> "bytes | None":
+    """Return the metric as a single JSON line, or None if it must not be forwarded.
+
+    A top-level "source" key is added to the document (tag in ws_json.conf).
+    """
+    if _CMD_PREFIX.match(message):
+        _stats.add(filtered=1)
+        return None
+    body = message.lstrip()
+    if "\n" not in message and body.startswith("{"):
+        # Already a compact document: splice the source key in, without re-encoding
+        sep = "" if body[1:].lstrip().startswith("}") else ","
+        return f'{{"source":{json.dumps(source)}{sep}{body[1:]}\n'.encode()
+    with suppress(ValueError):
+        doc = _decode(message)
+        if isinstance(doc, dict):
+            return _encode_json(doc, source)
+    _stats.add(filtered=1)
+    return None
+
+
+_FIRST_SPACE = re.compile(rb"(?m)^((?:[^ \\\n]|\\.)*) ")
+# Lines without a trailing timestamp: field tokens always contain "=", so a
+# last token made only of digits can only be the timestamp
+_NO_TIMESTAMP = re.compile(rb"(?m)^(?!.* -?\d+$)(.+)$")
+
+
+class _Spool:
+    """Gzip segments of line protocol kept on disk while InfluxDB is unavailable.
+
+    Metrics are appended to `<time_ns>.lp.gz.part`, renamed to `.lp.gz` once
+    the segment reaches SPOOL_SEGMENT_BYTES (uncompressed) or at the next
+    check while the sink is healthy. Completed segments are posted as they
+    are (already gzipped) to the InfluxDB write API, oldest first; the oldest
+    ones (including `.rejected` segments) are evicted when the spool exceeds
+    SPOOL_MAX_BYTES. Lines are stamped with the spooling time when they
+    have no timestamp, so they are not stored at the replay time.
+    """
+
+    def __init__(self, directory, write_url, health_url, token, host):
+        self.directory = directory
+        self.write_url = write_url
+        self.health_url = health_url
+        self.headers = {"Authorization": f"Token {token}"} if token else {}
+        # Telegraf adds the agent's host tag to what it forwards, the spool must too
+        self.host_tag = f",host={_tag_value(host)}".encode() if host else b""
+        self.lock = threading.Lock()
+        self.current = None
+        self.current_path = None
+        self.current_size = 0
+        self.sink_ok = True
+        self.evicted = 0
+
+        os.makedirs(directory, exist_ok=True)
+        # Segments left open by a previous run are still worth a replay attempt
+        for path in glob.glob(os.path.join(directory, "*.lp.gz.part")):
+            os.rename(path, path[: -len(".part")])
+
+    def segments(self) -> "list[str]":
+        return sorted(glob.glob(os.path.join(self.directory, "*.lp.gz")))
+
+    def _on_disk(self) -> "list[str]":
+        """Completed and rejected segments, oldest first."""
+        paths = glob.glob(os.path.join(self.directory, "*.lp.gz"))
+        paths += glob.glob(os.path.join(self.directory, "*.lp.gz.rejected"))
+        return sorted(paths, key=os.path.basename)
+
+    def status(self):
+        """Return (completed segments, bytes on disk, age of the oldest data)."""
+        with self.lock:
+            segments = self.segments()
+            paths = self._on_disk() + ([self.current_path] if self.current else [])
+        size = 0
+        for path in paths:
+            with suppress(OSError):
+                size += os.path.getsize(path)
+        oldest = paths[0] if paths else None
+        lag = (
+            (time_ns() - int(os.path.basename(oldest).split(".")[0])) / 1e9
+            if oldest
+            else 0.0
+        )
+        return len(segments), size, lag
+
+    def write(self, data: bytes):
+        data = _NO_TIMESTAMP.sub(rb"\1 " + str(time_ns()).encode(), data)
+        if self.host_tag:
+            data = _FIRST_SPACE.sub(lambda m: m.group(1) + self.host_tag + b" ", data)
+        with self.lock:
+            if self.current is None:
+                self.current_path = os.path.join(
+                    self.directory, f"{time_ns()}.lp.gz.part"
+                )
+                self.current = gzip.open(self.current_path, "wb", compresslevel=6)
+                self.current_size = 0
+            self.current.write(data)
+            self.current_size += len(data)
+            if self.current_size >= SPOOL_SEGMENT_BYTES:
+                self._rotate()
+
+    def rotate(self):
+        with self.lock:
+            self._rotate()
+
+    def _rotate(self):
+        if self.current is None:
+            return
+        self.current.close()
+        os.rename(self.current_path, self.current_path[: -len(".part")])
+        self.current = None
+        self.current_path = None
+
+        # Eviction and replay both remove segments: they are serialized by
+        # self.lock, a segment being posted may still vanish under replay()
+        segments = self._on_disk()
+        sizes = []
+        for path in segments:
+            try:
+                sizes.append(os.path.getsize(path))
+            except FileNotFoundError:
+                sizes.append(0)
+        total = sum(sizes)
+        while segments and total > SPOOL_MAX_BYTES:
+            with suppress(FileNotFoundError):
+                os.remove(segments.pop(0))
+                self.evicted += 1
+            total -= sizes.pop(0)
+
+    def _request(self, url, data=None, headers=None, timeout=None):
+        request = urllib.request.Request(
+            url, data=data, headers={**self.headers, **(headers or {})}
+        )
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status
+
+    def check_sink(self) -> bool:
+        try:
+            ok = self._request(self.health_url, timeout=SPOOL_CHECK_TIMEOUT) == 200
+        except (OSError, urllib.error.URLError):
+            ok = False
+        self.sink_ok = ok
+        return ok
+
+    def replay(self) -> int:
+        """Post completed segments to InfluxDB until done or the sink fails."""
+        replayed = 0
+        for path in self.segments():
+            try:
+                with open(path, "rb") as f:
+                    body = f.read()
+            except FileNotFoundError:
+                # Evicted by _rotate meanwhile
+                continue
+            try:
+                self._request(
+                    self.write_url,
+                    data=body,
+                    headers={
+                        "Content-Encoding": "gzip",
+                        "Content-Type": "text/plain; charset=utf-8",
+                    },
+                    timeout=max(30.0, SPOOL_CHECK_TIMEOUT),
+                )
+            except urllib.error.HTTPError as e:
+                if e.code != 429 and 400 <= e.code < 500:
+                    # The data itself is rejected: keep it aside instead of retrying forever
+                    print(
+                        f"ws_adapter: spool segment {path} rejected: {e}",
+                        file=sys.stderr,
+                        flush=True,
+                    )
+                    with self.lock, suppress(FileNotFoundError):
+                        os.rename(path, path + ".rejected")
+                    continue
+                self.sink_ok = False
+                break
+            except (OSError, urllib.error.URLError):
+                self.sink_ok = False
+                break
+            with self.lock, suppress(FileNotFoundError):
+                os.remove(path)
+            replayed += 1
+        return replayed
+
+
+def _sink_monitor(spool: _Spool):
+    while True:
+        try:
+            if spool.check_sink():
+                # Close the segment being written (data spooled during the
+                # outage, on backpressure or by a late writer batch) so that
+                # it is replayed now instead of when it gets full
+                spool.rotate()
+                replayed = spool.replay()
+                if replayed:
+                    print(
+                        f"ws_adapter: replayed {replayed} spool segment(s)",
+                        file=sys.stderr,
+                        flush=True,
+                    )
+        except Exception as e:
+            # Keep monitoring: a dead monitor would freeze sink_ok and the spool
+            print(
+                f"ws_adapter: spool monitor error: {e!r}", file=sys.stderr, flush=True
+            )
+        sleep(SPOOL_CHECK_INTERVAL)
+
+
+def _spool_write(data: bytes, count: int):
+    try:
+        _spool.write(data)
+    except OSError as e:
+        # e.g. disk full: the lines are lost, but the adapter keeps running
+        print(f"ws_adapter: spool write failed: {e!r}", file=sys.stderr, flush=True)
+        _stats.add(dropped=count)
+    else:
+        _stats.add(spooled=count)
+
+
+def _make_spool() -> "_Spool | None":
+    if not SPOOL_DIR:
+        return None
+    if OUTPUT_FORMAT != "influx":
+        print(
+            "ws_adapter: WS_SPOOL_DIR ignored, spooling requires WS_ADAPTER_FORMAT=influx",
+            file=sys.stderr,
+            flush=True,
+        )
+        return None
+    base_url = os.environ["INFLUXDB3_EXTERNAL_URL"].rstrip("/")
+    query = urllib.parse.urlencode(
+        {"bucket": os.environ.get("INFLUXDB3_BUCKET", ""), "precision": "ns"}
+    )
+    return _Spool(
+        SPOOL_DIR,
+        write_url=f"{base_url}/api/v2/write?{query}",
+        health_url=f"{base_url}/health",
+        token=os.environ.get("INFLUXDB3_AUTH_TOKEN", ""),
+        host=os.environ.get("INFLUXDB3_TESTBED", ""),
+    )
+
+
+_spool = _make_spool()
+
+
+def _writer(out):
+    """Drain the queue to stdout in bounded batches, flushing once per batch."""
+    while True:
+        batch = [_lines.get()]
+        deadline = monotonic() + FLUSH_INTERVAL
+        while len(batch) < BATCH_SIZE:
+            timeout = deadline - monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(_lines.get(timeout=timeout))
+            except queue.Empty:
+                break
+        if _spool is not None and not _spool.sink_ok:
+            _spool_write(b"".join(batch), len(batch))
+            continue
+        out.write(b"".join(batch))
+        out.flush()
+        _stats.add(forwarded=len(batch))
+
+
+def _exit_on_error(target, *args):
+    """Run a thread body; if it fails, exit so that Telegraf's execd restarts us.
+
+    A dead writer would otherwise leave the websockets running into a full
+    queue, dropping everything while the process looks alive.
+    """
+    try:
+        target(*args)
+    except BaseException:
+        print(f"ws_adapter: {target.__name__} failed, exiting", file=sys.stderr)
+        traceback.print_exc()
+        sys.stderr.flush()
+        os._exit(1)
+
+
+def _reporter():
+    while True:
+        sleep(STATS_INTERVAL)
+        forwarded, dropped, filtered, spooled, aggregated = _stats.take()
+        report = (
+            f"ws_adapter: forwarded={forwarded / STATS_INTERVAL:.1f}/s "
+            f"dropped={dropped / STATS_INTERVAL:.1f}/s "
+            f"filtered={filtered / STATS_INTERVAL:.1f}/s "
+            f"queued={_lines.qsize()}"
+        )
+        if _aggregator is not None:
+            report += f" aggregated_ues={aggregated / STATS_INTERVAL:.1f}/s"
+        if _spool is not None:
+            segments, size, lag = _spool.status()
+            report += (
+                f" spooled={spooled / STATS_INTERVAL:.1f}/s sink_ok={_spool.sink_ok}"
+                f" spool_segments={segments} spool_bytes={size} spool_lag={lag:.1f}s"
+                f" spool_evicted={_spool.evicted}"
+            )
+        print(report, file=sys.stderr, flush=True)
+
+
+def _parse_endpoints(value: str) -> "list[tuple[str, str]]":
+    """Parse WS_URL: comma/space separated "[name=]host:port" endpoints."""
+    endpoints = []
+    for item in value.replace(",", " ").split():
+        name, sep, url = item.partition("=")
+        if not sep:
+            name = url = item
+        endpoints.append((name, url))
+    return endpoints
+
+
+def _publish(message: str, source: str):
+    line = _convert(message, source)
+    if line is not None:
+        _enqueue(line)
+
+
+def _enqueue(line: bytes):
+    try:
+        _lines.put_nowait(line)
+    except queue.Full:
+        # Telegraf is not keeping up: spool or drop instead of stalling the websockets
+        if _spool is not None:
+            _spool_write(line, 1)
+        else:
+            _stats.add(dropped=1)
+
+
+async def _subscribe(source: str, url: str):
+    """Relay one endpoint forever, reconnecting with exponential backoff and jitter."""
+    attempt = 0
+    connected_at = None
+    while True:
+        try:
+            async with websockets.connect(
+                "ws://" + url,
+                ping_interval=PING_INTERVAL or None,
+                ping_timeout=PING_TIMEOUT or None,
+                max_size=None,
+            ) as ws:
+                await ws.send(json.dumps({"cmd": "metrics_subscribe"}))
+                print(
+                    f"ws_adapter: connected to {source} ({url})",
+                    file=sys.stderr,
+                    flush=True,
+                )
+                connected_at = monotonic()
+                async for message in ws:
+                    if isinstance(message, bytes):
+                        message = message.decode(errors="replace")
+                    _publish(message, source)
+            reason = "closed by peer"
+        except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+            reason = repr(e)
+        if connected_at is not None and monotonic() - connected_at > BACKOFF_MAX:
+            # Only a connection that stayed up for a while resets the backoff
+            attempt = 0
+        connected_at = None
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_MIN * 2**attempt))
+        attempt += 1
+        print(
+            f"ws_adapter: {source} ({url}) disconnected: {reason}, retrying in {delay:.1f}s",
+            file=sys.stderr,
+            flush=True,
+        )
+        await asyncio.sleep(delay)
+
+
+async def _aggregate():
+    # Runs on the event loop like _publish, so the aggregator needs no locking
+    while True:
+        await asyncio.sleep(AGGREGATE_INTERVAL)
+        for doc, source in _aggregator.flush():
+            line = _encode(doc, source)
+            if line is not None:
+                _enqueue(line)
+
+
+async def _main(endpoints):
+    tasks = [_subscribe(name, url) for name, url in endpoints]
+    if _aggregator is not None:
+        tasks.append(_aggregate())
+    await asyncio.gather(*tasks)
+
+
+if _aggregator is not None:
+    _convert = _to_aggregated
+elif OUTPUT_FORMAT == "influx":
+    _convert = _to_influx_lines
+else:
+    _convert = _to_line
+
+
+if __name__ == "__main__":
+    threading.Thread(
+        target=_exit_on_error,
+        args=(_writer, sys.stdout.buffer),
+        daemon=True,
+        name="writer",
+    ).start()
+    if STATS_INTERVAL > 0:
+        threading.Thread(target=_reporter, daemon=True, name="stats").start()
+    if _spool is not None:
+        threading.Thread(
+            target=_sink_monitor, args=(_spool,), daemon=True, name="spool"
+        ).start()
+
+    asyncio.run(_main(_parse_endpoints(os.environ["WS_URL"])))
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+log = logging.getLogger("iq_analyze")
+
+# Captures are raw interleaved float32 I/Q (gr_complex), as written by the broker
+SAMPLE_DTYPE = np.complex64
+
+# Per-process cache of memory maps, so a worker maps each capture only once
+_maps: Dict[str, np.memmap] = {}
+
+
+def setup_logging() -> None:
+    level_name = os.getenv("LOG_LEVEL", "INFO").upper()
+    level = getattr(logging, level_name, logging.INFO)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(
+        logging.Formatter(
+            fmt="%(asctime)s [%(levelname)s] %(name)s | %(message)s",
+            datefmt="%Y-%m-%dT%H:%M:%S",
+        )
+    )
+
+    log.handlers.clear()
+    log.setLevel(level)
+    log.addHandler(handler)
+
+    logging.Formatter.converter = time.localtime
+
+
+def open_capture(path: str) -> np.memmap:
+    iq = _maps.get(path)
+    if iq is None:
+        # Whole samples only: a capture cut off mid-sample (e.g. broker killed)
+        # has a trailing partial sample that np.memmap would refuse
+        n_samples = os.path.getsize(path) // np.dtype(SAMPLE_DTYPE).itemsize
+        iq = np.memmap(path, dtype=SAMPLE_DTYPE, mode="r", shape=(n_samples,))
+        _maps[path] = iq
+    return iq
+
+
+def analyze_chunk(
+    path: str, start: int, stop: int, power_window: int, fft_size: int
+) -> Tuple[int, np.ndarray, np.ndarray, int]:
+    """Power trace and summed PSD of samples [start, stop) of a capture.
+
+    Runs in a worker process: only the chunk is paged in from the memory map.
+    """
+    x = np.asarray(open_capture(path)[start:stop])
+
+    n_windows = len(x) // power_window
+    p = np.abs(x[: n_windows * power_window]) ** 2
+    power = p.reshape(n_windows, power_window).mean(axis=1, dtype=np.float64)
+
+    n_frames = len(x) // fft_size
+    psd = np.zeros(fft_size, dtype=np.float64)
+    if n_frames:
+        frames = x[: n_frames * fft_size].reshape(n_frames, fft_size)
+        spectrum = np.fft.fft(frames * np.hanning(fft_size).astype(np.float32), axis=1)
+        psd = (np.abs(spectrum) ** 2).sum(axis=0, dtype=np.float64)
+
+    return start, power.astype(np.float32), psd, n_frames
+
+
+def to_db(x: np.ndarray) -> np.ndarray:
+    return (10.0 * np.log10(np.maximum(x, 1e-20))).astype(np.float32)
+
+
+def find_runs(mask: np.ndarray) -> np.ndarray:
+    """[start, stop) index pairs of the True runs of a boolean array."""
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return np.stack((np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)), axis=1)
+
+
+def analyze_capture(
+    pool: ProcessPoolExecutor, path: str, args: argparse.Namespace
+) -> Dict[str, np.ndarray]:
+    n_samples = os.path.getsize(path) // np.dtype(SAMPLE_DTYPE).itemsize
+    # Chunks are a whole number of power windows, so windows never straddle chunks
+    chunk = max(args.chunk_samples // args.power_window, 1) * args.power_window
+    starts = range(0, n_samples, chunk)
+    log.info(
+        f"Analyzing {path}: {n_samples} samples in {len(starts)} chunks of {chunk}"
+    )
+
+    power_parts: List[np.ndarray] = []
+    spectrogram: List[np.ndarray] = []
+    psd_sum = np.zeros(args.fft_size, dtype=np.float64)
+    n_frames = 0
+    results = pool.map(
+        analyze_chunk,
+        [path] * len(starts),
+        starts,
+        [min(s + chunk, n_samples) for s in starts],
+        [args.power_window] * len(starts),
+        [args.fft_size] * len(starts),
+    )
+    for _, power, psd, frames in results:
+        power_parts.append(power)
+        if frames:
+            spectrogram.append(psd / frames)
+            psd_sum += psd
+            n_frames += frames
+
+    power = np.concatenate(power_parts) if power_parts else np.zeros(0, np.float32)
+    power_db = to_db(power)
+
+    # Digital silence (the ZMQ radios send zeros when idle) vs. bursts above the floor
+    silent = power_db < args.silence_db
+    active_db = power_db[~silent]
+    noise_floor_db = float(np.percentile(active_db, 10)) if len(active_db) else None
+    if noise_floor_db is None:
+        bursts = np.zeros((0, 2), dtype=np.int64)
+    else:
+        bursts = find_runs(power_db > noise_floor_db + args.burst_threshold_db)
+    silences = find_runs(silent)
+
+    psd_db = to_db(np.fft.fftshift(psd_sum / max(n_frames, 1)))
+    spectrogram_db = (
+        to_db(np.fft.fftshift(np.stack(spectrogram), axes=1))
+        if spectrogram
+        else np.zeros((0, args.fft_size), np.float32)
+    )
+
+    return {
+        "n_samples": np.int64(n_samples),
+        "power_window": np.int64(args.power_window),
+        "power_db": power_db,
+        "psd_db": psd_db,
+        "spectrogram_db": spectrogram_db,
+        "spectrogram_chunk": np.int64(chunk),
+        "freqs": np.fft.fftshift(
+            np.fft.fftfreq(args.fft_size, d=1.0 / args.sample_rate)
+        ),
+        "noise_floor_db": np.float32(
+            np.nan if noise_floor_db is None else noise_floor_db
+        ),
+        # Run boundaries are converted from power windows to sample indexes
+        "bursts": bursts * args.power_window,
+        "silences": silences * args.power_window,
+    }
+
+
+def align(
+    power_a_db: np.ndarray, power_b_db: np.ndarray, max_lag: int
+) -> Tuple[int, float]:
+    """Lag (in power windows) of b relative to a from their envelope cross-correlation."""
+    n = min(len(power_a_db), len(power_b_db))
+    if n < 2:
+        return 0, 0.0
+    a = 10 ** (power_a_db[:n].astype(np.float64) / 10)
+    b = 10 ** (power_b_db[:n].astype(np.float64) / 10)
+    a = (a - a.mean()) / (a.std() or 1.0)
+    b = (b - b.mean()) / (b.std() or 1.0)
+
+    size = 1 << int(np.ceil(np.log2(2 * n)))
+    xcorr = np.fft.irfft(np.fft.rfft(b, size) * np.conj(np.fft.rfft(a, size)), size) / n
+    lags = np.concatenate((np.arange(0, n), np.arange(-n + 1, 0)))
+    values = np.concatenate((xcorr[:n], xcorr[size - n + 1 :]))
+    keep = np.abs(lags) <= max_lag
+    best = int(np.argmax(values[keep]))
+    return int(lags[keep][best]), float(values[keep][best])
+
+
+def write_parquet(out_base: str, result: Dict[str, np.ndarray]) -> None:
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        log.error("--parquet requires pyarrow (pip install pyarrow)")
+        raise SystemExit(2)
+
+    window = int(result["power_window"])
+    pq.write_table(
+        pa.table(
+            {
+                "sample": np.arange(len(result["power_db"]), dtype=np.int64) * window,
+                "power_db": result["power_db"],
+            }
+        ),
+        f"{out_base}_power.parquet",
+    )
+    events = [("burst", r) for r in result["bursts"]] + [
+        ("silence", r) for r in result["silences"]
+    ]
+    pq.write_table(
+        pa.table(
+            {
+                "kind": [kind for kind, _ in events],
+                "start": np.array([r[0] for _, r in events], dtype=np.int64),
+                "stop": np.array([r[1] for _, r in events], dtype=np.int64),
+            }
+        ),
+        f"{out_base}_events.parquet",
+    )
+
+
+def main():
+    setup_logging()
+
+    ap = argparse.ArgumentParser(
+        description="Offline analysis of .fc32 IQ captures from iq_broker.py / zmq_broker_recorder.py"
+    )
+    ap.add_argument("captures", nargs="+", help=".fc32 capture files")
+    ap.add_argument(
+        "--out-dir", default="/iq/analysis", help="Output directory for the summaries"
+    )
+    ap.add_argument(
+        "--chunk-samples",
+        type=int,
+        default=1 << 22,
+        help="Samples processed per task (bounds per-worker memory)",
+    )
+    ap.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="Worker processes"
+    )
+    ap.add_argument(
+        "--power-window",
+        type=int,
+        default=1024,
+        help="Samples averaged into each point of the power trace",
+    )
+    ap.add_argument(
+        "--fft-size", type=int, default=1024, help="PSD/spectrogram FFT size"
+    )
+    ap.add_argument(
+        "--sample-rate",
+        type=float,
+        default=1.0,
+        help="Sample rate in Hz, for the frequency axis (default: normalized)",
+    )
+    ap.add_argument(
+        "--burst-threshold-db",
+        type=float,
+        default=10.0,
+        help="Bursts are power windows this many dB above the noise floor",
+    )
+    ap.add_argument(
+        "--silence-db",
+        type=float,
+        default=-100.0,
+        help="Power windows below this level (dBFS) are silence",
+    )
+    ap.add_argument(
+        "--align",
+        nargs=2,
+        metavar=("DL", "UL"),
+        default=None,
+        help="Two of the captures to align by power envelope cross-correlation",
+    )
+    ap.add_argument(
+        "--max-lag",
+        type=int,
+        default=None,
+        help="Max alignment lag in samples (default: whole capture)",
+    )
+    ap.add_argument(
+        "--parquet",
+        action="store_true",
+        help="Also write power trace and bursts/silences as Parquet (needs pyarrow)",
+    )
+    args = ap.parse_args()
+
+    if args.align and not set(args.align) <= set(args.captures):
+        ap.error("--align files must also be listed as captures")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    results: Dict[str, Dict[str, np.ndarray]] = {}
+    summary = {}
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for path in args.captures:
+            result = analyze_capture(pool, path, args)
+            results[path] = result
+
+            name = os.path.splitext(os.path.basename(path))[0]
+            out_base = os.path.join(args.out_dir, name)
+            np.savez_compressed(f"{out_base}.npz", **result)
+            if args.parquet:
+                write_parquet(out_base, result)
+
+            summary[path] = {
+                "samples": int(result["n_samples"]),
+                # None for an all-silent capture (NaN is not valid JSON)
+                "noise_floor_db": (
+                    None
+                    if np.isnan(result["noise_floor_db"])
+                    else float(result["noise_floor_db"])
+                ),
+                "mean_psd_db": float(np.mean(result["psd_db"])),
+                "bursts": len(result["bursts"]),
+                "silences": len(result["silences"]),
+                "output": f"{out_base}.npz",
+            }
+            log.info(f"{path}: {json.dumps(summary[path])}")
+
+    if args.align:
+        dl, ul = args.align
+        window = args.power_window
+        max_lag = (args.max_lag or int(results[dl]["n_samples"])) // window
+        lag, peak = align(results[dl]["power_db"], results[ul]["power_db"], max_lag)
+        summary["alignment"] = {
+            "dl": dl,
+            "ul": ul,
+            "lag_samples": lag * window,
+            "resolution_samples": window,
+            "peak": peak,
+        }
+        log.info(
+            f"Alignment: {ul} lags {dl} by {lag * window} samples (+/- {window}, peak={peak:.3f})"
+        )
+
+    summary_path = os.path.join(args.out_dir, "summary.json")
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2, allow_nan=False)
+    log.info(f"Summary written to {summary_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,7 +8,7 @@ import logging
 import sys
 import zmq
 from datetime import datetime
-from typing import Optional, BinaryIO
+from typing import Dict, List, Optional, BinaryIO, Sequence
 
 log = logging.getLogger("iq_broker")
 
@@ -35,15 +35,14 @@ def _local_tag() -> str:
 
 
 class Recorder:
-    def __init__(self, out_dir: str):
+    def __init__(self, out_dir: str, streams: Sequence[str] = ("dl", "ul")):
         self.out_dir = out_dir
+        self.streams = list(streams)
         self.lock = threading.Lock()
         self.enabled = False
-        self.dl_f: Optional[BinaryIO] = None
-        self.ul_f: Optional[BinaryIO] = None
+        self.files: Dict[str, BinaryIO] = {}
         self.tag: Optional[str] = None
-        self.dl_path: Optional[str] = None
-        self.ul_path: Optional[str] = None
+        self.paths: Dict[str, str] = {}
 
     def start(self, tag: str):
         with self.lock:
@@ -53,36 +52,30 @@ class Recorder:
                     "ok": True,
                     "msg": "already recording",
                     "tag": self.tag,
-                    "dl": self.dl_path,
-                    "ul": self.ul_path,
+                    **self.paths,
                 }
             os.makedirs(self.out_dir, exist_ok=True)
-            dl_path = os.path.join(self.out_dir, f"{tag}_dl.fc32")
-            ul_path = os.path.join(self.out_dir, f"{tag}_ul.fc32")
+            paths = {
+                stream: os.path.join(self.out_dir, f"{tag}_{stream}.fc32")
+                for stream in self.streams
+            }
 
-            dl_f: Optional[BinaryIO] = None
-            ul_f: Optional[BinaryIO] = None
+            files: Dict[str, BinaryIO] = {}
             try:
-                dl_f = open(dl_path, "wb")
-                ul_f = open(ul_path, "wb")
+                for stream, path in paths.items():
+                    files[stream] = open(path, "wb")
             except Exception:
-                log.exception(
-                    f"Failed to open output files (dl: {dl_path} ul: {ul_path})"
-                )
-                if dl_f:
-                    dl_f.close()
-                if ul_f:
-                    ul_f.close()
+                log.exception(f"Failed to open output files ({paths})")
+                for f in files.values():
+                    f.close()
                 raise
 
-            self.dl_f = dl_f
-            self.ul_f = ul_f
+            self.files = files
             self.enabled = True
             self.tag = tag
-            self.dl_path = dl_path
-            self.ul_path = ul_path
+            self.paths = paths
             log.info(f"Recording started. Tag: {tag}")
-            return {"ok": True, "tag": tag, "dl": dl_path, "ul": ul_path}
+            return {"ok": True, "tag": tag, **paths}
 
     def stop(self):
         with self.lock:
@@ -91,38 +84,35 @@ class Recorder:
                 return {"ok": True, "msg": "already stopped"}
 
             tag = self.tag
-            dl_path = self.dl_path
-            ul_path = self.ul_path
+            paths = self.paths
 
             try:
-                if self.dl_f:
-                    self.dl_f.flush()
-                    self.dl_f.close()
-                if self.ul_f:
-                    self.ul_f.flush()
-                    self.ul_f.close()
+                for f in self.files.values():
+                    f.flush()
+                    f.close()
             finally:
-                self.dl_f = None
-                self.ul_f = None
+                self.files = {}
                 self.enabled = False
                 self.tag = None
-                self.dl_path = None
-                self.ul_path = None
+                self.paths = {}
 
             log.info(
-                f"Recording stopped. Output files: {dl_path} | ul: {ul_path}"
+                "Recording stopped. Output files: %s",
+                " | ".join(f"{stream}: {path}" for stream, path in paths.items()),
             )
-            return {"ok": True, "tag": tag, "dl": dl_path, "ul": ul_path}
+            return {"ok": True, "tag": tag, **paths}
 
-    def write_dl(self, payload: bytes):
+    def write(self, stream: str, payload: bytes):
         with self.lock:
-            if self.enabled and self.dl_f:
-                self.dl_f.write(payload)
+            f = self.files.get(stream)
+            if self.enabled and f:
+                f.write(payload)
+
+    def write_dl(self, payload: bytes):
+        self.write("dl", payload)
 
     def write_ul(self, payload: bytes):
-        with self.lock:
-            if self.enabled and self.ul_f:
-                self.ul_f.write(payload)
+        self.write("ul", payload)
 
 
 def bind_or_connect(sock: zmq.Socket, endpoint: str):
@@ -216,6 +206,40 @@ def relay_loop(
             time.sleep(0.5)
 
 
+def handle_control(msg: bytes, recorder: Recorder) -> dict:
+    # Always returns a reply: the REP socket must answer every request, and in
+    # poller mode an exception here would stop every relayed pair
+    try:
+        cmd = json.loads(msg.decode("utf-8"))
+    except Exception:
+        log.warning(f"Control: invalid JSON (len={len(msg)})")
+        return {"ok": False, "err": "invalid json"}
+    if not isinstance(cmd, dict):
+        log.warning("Control: JSON is not an object")
+        return {"ok": False, "err": "invalid cmd"}
+
+    c = str(cmd.get("cmd", "")).upper()
+    try:
+        if c == "START":
+            tag = cmd.get("tag") or _local_tag()
+            log.debug(f"Control: received START cmd")
+            if not isinstance(tag, str):
+                return {"ok": False, "err": "tag must be a string"}
+            return recorder.start(tag)
+        elif c == "STOP":
+            log.debug("Control: received STOP cmd")
+            return recorder.stop()
+        elif c == "STATUS":
+            log.debug("Control: received STATUS cmd")
+            return {"ok": True, "recording": recorder.enabled, "tag": recorder.tag}
+        else:
+            log.warning(f"Control: unknown command ({c})")
+            return {"ok": False, "err": "unknown cmd"}
+    except Exception as e:
+        log.exception(f"Control: {c} failed")
+        return {"ok": False, "err": str(e)}
+
+
 def control_loop(ctx: zmq.Context, ctl_rep: str, recorder: Recorder):
     ctl = ctx.socket(zmq.REP)
     ctl.setsockopt(zmq.LINGER, 0)
@@ -224,27 +248,251 @@ def control_loop(ctx: zmq.Context, ctl_rep: str, recorder: Recorder):
 
     while True:
         msg = ctl.recv()
+        ctl.send_json(handle_control(msg, recorder))
+
+
+class PolledRelay:
+    """One relay direction as a non-blocking state machine for a shared zmq.Poller.
+
+    Same REQ/REP handshake as relay_loop: wait for a request on the front REP
+    socket, forward it on the back REQ socket, wait for the IQ reply, record
+    it and return it to the front. A message is only received once it can be
+    kept until the next socket is writable (e.g. a bound back socket whose
+    peer has not connected yet), and only the socket/event the state waits
+    on is polled.
+    """
+
+    WAIT_REQUEST = 0  # front POLLIN
+    SEND_REQUEST = 1  # back POLLOUT, token pending
+    WAIT_REPLY = 2  # back POLLIN
+    SEND_REPLY = 3  # front POLLOUT, payload pending
+
+    def __init__(
+        self,
+        name: str,
+        ctx: zmq.Context,
+        front_rep: str,
+        back_req: str,
+        recorder: Recorder,
+        stream: str,
+    ):
+        self.name = name
+        self.ctx = ctx
+        self.front_rep = front_rep
+        self.back_req = back_req
+        self.recorder = recorder
+        self.stream = stream
+        self.msgs = 0
+        self.bytes_total = 0
+        self.open()
+
+    def open(self):
+        # front: REP towards the receiver (receiver uses REQ)
+        # back:  REQ towards the transmitter (transmitter uses REP)
+        front = self.ctx.socket(zmq.REP)
+        back = self.ctx.socket(zmq.REQ)
         try:
-            cmd = json.loads(msg.decode("utf-8"))
+            front.setsockopt(zmq.LINGER, 0)
+            back.setsockopt(zmq.LINGER, 0)
+            bind_or_connect(front, self.front_rep)
+            bind_or_connect(back, self.back_req)
         except Exception:
-            log.warning(f"Control: invalid JSON (len={len(msg)})")
-            ctl.send_json({"ok": False, "err": "invalid json"})
-            continue
-
-        c = str(cmd.get("cmd", "")).upper()
-        if c == "START":
-            tag = cmd.get("tag") or _local_tag()
-            log.debug(f"Control: received START cmd")
-            ctl.send_json(recorder.start(tag))
-        elif c == "STOP":
-            log.debug("Control: received STOP cmd")
-            ctl.send_json(recorder.stop())
-        elif c == "STATUS":
-            log.debug("Control: received STATUS cmd")
-            ctl.send_json({"ok": True, "recording": recorder.enabled, "tag": recorder.tag})
+            front.close()
+            back.close()
+            raise
+        self.front = front
+        self.back = back
+        self.state = self.WAIT_REQUEST
+        self.pending: Optional[bytes] = None
+
+    def close(self):
+        self.front.close()
+        self.back.close()
+
+    def reopen(self) -> bool:
+        self.close()
+        try:
+            self.open()
+            return True
+        except zmq.ZMQError:
+            log.exception(
+                "%s relay cannot be reopened (front_rep=%s back_req=%s)",
+                self.name,
+                self.front_rep,
+                self.back_req,
+            )
+            return False
+
+    @property
+    def waiting_on(self):
+        if self.state == self.WAIT_REQUEST:
+            return self.front, zmq.POLLIN
+        if self.state == self.SEND_REQUEST:
+            return self.back, zmq.POLLOUT
+        if self.state == self.WAIT_REPLY:
+            return self.back, zmq.POLLIN
+        return self.front, zmq.POLLOUT
+
+    def on_ready(self):
+        if self.state == self.WAIT_REQUEST:
+            # request, typically empty or small
+            self.pending = self.front.recv(zmq.NOBLOCK)
+            self.state = self.SEND_REQUEST
+            self._send_request()
+        elif self.state == self.SEND_REQUEST:
+            self._send_request()
+        elif self.state == self.WAIT_REPLY:
+            payload = self.back.recv(zmq.NOBLOCK)  # reply = IQ bytes
+            self.pending = payload
+            self.state = self.SEND_REPLY
+            self.msgs += 1
+            self.bytes_total += len(payload)
+            self.recorder.write(self.stream, payload)
+            self._send_reply()
         else:
-            log.warning(f"Control: unknown command ({c})")
-            ctl.send_json({"ok": False, "err": "unknown cmd"})
+            self._send_reply()
+
+    def _send_request(self):
+        try:
+            self.back.send(self.pending, zmq.NOBLOCK)  # forward request to TX
+        except zmq.Again:
+            return  # TX not reachable yet: wait for POLLOUT on back
+        self.pending = None
+        self.state = self.WAIT_REPLY
+
+    def _send_reply(self):
+        try:
+            self.front.send(self.pending, zmq.NOBLOCK)  # reply to RX
+        except zmq.Again:
+            return  # wait for POLLOUT on front
+        self.pending = None
+        self.state = self.WAIT_REQUEST
+
+
+def poller_loop(
+    ctx: zmq.Context, relays: List[PolledRelay], ctl_rep: str, recorder: Recorder
+):
+    ctl = ctx.socket(zmq.REP)
+    ctl.setsockopt(zmq.LINGER, 0)
+    bind_or_connect(ctl, ctl_rep)
+
+    poller = zmq.Poller()
+    poller.register(ctl, zmq.POLLIN)
+    waiting: Dict[zmq.Socket, PolledRelay] = {}
+
+    def watch(relay: PolledRelay):
+        sock, event = relay.waiting_on
+        poller.register(sock, event)
+        waiting[sock] = relay
+
+    for relay in relays:
+        watch(relay)
+    log.info(f"Poller loop started ({len(relays)} relays, ctl_rep={ctl_rep})")
+
+    # Relays whose sockets could not be reopened, retried once per second
+    broken: List[PolledRelay] = []
+    last_retry = last_report = time.time()
+    while True:
+        for sock, _ in poller.poll(timeout=1000):
+            if sock is ctl:
+                ctl.send_json(handle_control(ctl.recv(), recorder))
+                continue
+
+            relay = waiting.pop(sock)
+            poller.unregister(sock)
+            try:
+                relay.on_ready()
+            except zmq.Again:
+                # Spurious wakeup on recv: nothing was consumed, poll it again
+                pass
+            except zmq.ZMQError:
+                log.exception(
+                    "%s relay ZMQ error (front_rep=%s back_req=%s), reopening",
+                    relay.name,
+                    relay.front_rep,
+                    relay.back_req,
+                )
+                if not relay.reopen():
+                    broken.append(relay)
+                    continue
+            except Exception:
+                log.exception(
+                    "%s relay unexpected error (front_rep=%s back_req=%s)",
+                    relay.name,
+                    relay.front_rep,
+                    relay.back_req,
+                )
+            watch(relay)
+
+        now = time.time()
+        if broken and now - last_retry >= 1.0:
+            for relay in list(broken):
+                if relay.reopen():
+                    broken.remove(relay)
+                    watch(relay)
+            last_retry = now
+
+        if now - last_report >= 5.0:
+            for relay in relays:
+                log.info(
+                    "%s relay stats: msgs=%d bytes=%d recording=%s",
+                    relay.name,
+                    relay.msgs,
+                    relay.bytes_total,
+                    recorder.enabled,
+                )
+            last_report = now
+
+
+def run_config(config_path: str, ctl_rep: str, out_dir: str):
+    """Relay every pair listed in a JSON config file from a single thread."""
+    with open(config_path, "r") as f:
+        config = json.load(f)
+
+    ctl_rep = config.get("ctl_rep", ctl_rep)
+    out_dir = config.get("out_dir", out_dir)
+    pairs = config.get("pairs", [])
+    if not pairs:
+        raise SystemExit(f"No relay pairs defined in {config_path}")
+
+    names = [pair["name"] for pair in pairs]
+    if len(set(names)) != len(names):
+        raise SystemExit(f"Duplicate pair names in {config_path}")
+
+    log.info(
+        f"Starting Broker (poller mode): config={config_path} | "
+        + f"pairs={','.join(names)} | ctl_rep={ctl_rep} | out_dir={out_dir}"
+    )
+
+    ctx = zmq.Context.instance()
+    recorder = Recorder(
+        out_dir, [f"{name}_{d}" for name in names for d in ("dl", "ul")]
+    )
+    relays = []
+    for pair in pairs:
+        name = pair["name"]
+        relays.append(
+            PolledRelay(
+                f"{name}/DL",
+                ctx,
+                pair["dl_front_rep"],
+                pair["dl_back_req"],
+                recorder,
+                f"{name}_dl",
+            )
+        )
+        relays.append(
+            PolledRelay(
+                f"{name}/UL",
+                ctx,
+                pair["ul_front_rep"],
+                pair["ul_back_req"],
+                recorder,
+                f"{name}_ul",
+            )
+        )
+
+    poller_loop(ctx, relays, ctl_rep, recorder)
 
 
 def main():
@@ -252,30 +500,47 @@ def main():
     ap = argparse.ArgumentParser()
     ap.add_argument(
         "--dl-front-rep",
-        required=True,
         help="REP endpoint on the UE RX side (broker replies)",
     )
     ap.add_argument(
         "--dl-back-req",
-        required=True,
         help="REQ endpoint towards the gNB TX side (broker requests)",
     )
     ap.add_argument(
         "--ul-front-rep",
-        required=True,
         help="REP endpoint on the gNB RX side (broker replies)",
     )
     ap.add_argument(
         "--ul-back-req",
-        required=True,
         help="REQ endpoint towards the UE TX side (broker requests)",
     )
+    ap.add_argument(
+        "--config",
+        help="JSON file listing many DL/UL relay pairs, all served by one poller "
+        "thread (replaces the --dl-*/--ul-* endpoints)",
+    )
     ap.add_argument(
         "--ctl-rep", default="tcp://0.0.0.0:5555", help="Control REP endpoint"
     )
     ap.add_argument("--out-dir", default="/iq", help="Output directory for .fc32")
     args = ap.parse_args()
 
+    if args.config:
+        run_config(args.config, args.ctl_rep, args.out_dir)
+        return
+
+    endpoints = (
+        args.dl_front_rep,
+        args.dl_back_req,
+        args.ul_front_rep,
+        args.ul_back_req,
+    )
+    if not all(endpoints):
+        ap.error(
+            "--dl-front-rep, --dl-back-req, --ul-front-rep and --ul-back-req "
+            "are required without --config"
+        )
+
     log.info(
         f"Starting Broker: dl_front_rep={args.dl_front_rep} | "
         + f"dl_back_req={args.dl_back_req} | "